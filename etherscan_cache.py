@@ -0,0 +1,84 @@
+"""
+File: etherscan_cache.py
+Cache source code kontrak dari Etherscan. Source code kontrak yang sudah terverifikasi tidak
+berubah untuk satu alamat, sehingga cukup diambil sekali lalu disimpan di memori (LRU) dan SQLite.
+"""
+
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+from contextlib import closing
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+CACHE_DB_PATH = os.getenv("ETHERSCAN_CACHE_PATH", "etherscan_cache.db")
+MEMORY_CACHE_SIZE = 256
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS etherscan_source (
+    address TEXT PRIMARY KEY,
+    code TEXT NOT NULL,
+    fetched_at INTEGER NOT NULL
+);
+"""
+
+_memory_cache: "OrderedDict[str, str]" = OrderedDict()
+_schema_ready = False
+
+def _connect() -> sqlite3.Connection:
+    """
+    Membuka koneksi SQLite dan memastikan tabel cache sudah ada.
+    `with conn` hanya commit/rollback, jadi pemanggil menutup koneksi lewat contextlib.closing.
+    """
+    global _schema_ready
+    conn = sqlite3.connect(CACHE_DB_PATH)
+    if not _schema_ready:
+        conn.executescript(_SCHEMA)
+        _schema_ready = True
+    return conn
+
+def _remember(address: str, code: str) -> None:
+    _memory_cache[address] = code
+    _memory_cache.move_to_end(address)
+    if len(_memory_cache) > MEMORY_CACHE_SIZE:
+        _memory_cache.popitem(last=False)
+
+def _check_sync(address: str) -> Optional[str]:
+    with closing(_connect()) as conn, conn:
+        row = conn.execute("SELECT code FROM etherscan_source WHERE address = ?", (address,)).fetchone()
+    return row[0] if row else None
+
+def _save_sync(address: str, code: str) -> None:
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO etherscan_source (address, code, fetched_at) VALUES (?, ?, ?)",
+            (address, code, int(time.time())),
+        )
+
+async def check(address: str) -> Optional[str]:
+    """Mencari source code untuk alamat kontrak, pertama di memori lalu di SQLite."""
+    key = address.lower()
+    if key in _memory_cache:
+        _memory_cache.move_to_end(key)
+        return _memory_cache[key]
+    try:
+        code = await asyncio.to_thread(_check_sync, key)
+    except sqlite3.Error as e:
+        logger.warning(f"Gagal membaca cache Etherscan: {e}")
+        return None
+    if code is not None:
+        _remember(key, code)
+    return code
+
+async def save(address: str, code: str) -> None:
+    """Menyimpan source code untuk alamat kontrak ke memori dan SQLite."""
+    key = address.lower()
+    _remember(key, code)
+    try:
+        await asyncio.to_thread(_save_sync, key, code)
+    except sqlite3.Error as e:
+        logger.warning(f"Gagal menyimpan cache Etherscan: {e}")
@@ -0,0 +1,59 @@
+"""
+File: json_utils.py
+Helper serialisasi JSON yang dipakai bersama oleh semua modul.
+orjson bersifat opsional, jika tidak terinstal gunakan modul json bawaan.
+"""
+
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson menolak integer di luar rentang 64-bit (TypeError), padahal nilai dalam
+# satuan wei (mis. total_supply 10**27) lazim muncul di input. Untuk kasus itu
+# serialisasi jatuh kembali ke modul json bawaan dengan opsi yang sama.
+
+def loads_json(data: Union[str, bytes]) -> Any:
+    """Parse JSON (str/bytes). Error parsing selalu berupa json.JSONDecodeError (turunan ValueError)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dumps_json(data: Any) -> str:
+    """Serialisasi data ke string JSON (indent 2)."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_INDENT_2).decode()
+        except TypeError:
+            pass
+    return json.dumps(data, indent=2)
+
+def compact_json(data: Any) -> str:
+    """Serialisasi data ke string JSON satu baris tanpa spasi."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data).decode()
+        except TypeError:
+            pass
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+def compact_json_bytes(data: Any) -> bytes:
+    """Serialisasi data ke JSON satu baris dalam bentuk bytes UTF-8, siap dikirim sebagai body HTTP."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            pass
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def canonical_json_bytes(data: Any) -> bytes:
+    """Serialisasi kanonik (key terurut) untuk keperluan hashing."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(data, sort_keys=True, separators=(",", ":")).encode()
@@ -1,17 +1,79 @@
 import os
-import json
-import requests
 import asyncio
+import hashlib
 import logging
+from collections import OrderedDict
+from contextlib import aclosing
+from functools import cached_property, lru_cache
+import httpx
+import ijson
 from pydantic import BaseModel, Field, field_validator, model_validator
-from typing import List, Dict, Any, Optional
+from typing import AbstractSet, List, Dict, Any, AsyncIterator, Callable, Optional, Tuple
 
 from prompt import KAG_SYSTEM_PROMPT
 from recomendation_prompt import RECOMMENDATION_SYSTEM_PROMPT
+import llm_cache
+from json_utils import canonical_json_bytes, compact_json, compact_json_bytes, dumps_json, loads_json
 
 # Konfigurasi logging
 logger = logging.getLogger(__name__)
 
+# Versi prompt KAG, naikkan setiap kali prompt berubah agar cache lama tidak terpakai
+PROMPT_VERSION = "v4"
+
+GEMINI_MODEL_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest"
+LLM_TIMEOUT_SECONDS = int(os.getenv("LLM_TIMEOUT_SECONDS", "180"))
+# Prompt di atas batas ini dipecah per kontrak dan dianalisis paralel
+LLM_PARTITION_TOKENS = int(os.getenv("LLM_PARTITION_TOKENS", "200000"))
+# Jumlah maksimum request ke Gemini yang berjalan bersamaan
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+# Jumlah maksimum temuan pada analisis streaming (0 = tanpa batas)
+LLM_MAX_FINDINGS = int(os.getenv("LLM_MAX_FINDINGS", "0"))
+# Field top-level yang wajib ada pada respons analisis LLM
+REQUIRED_REPORT_KEYS = {"executive_summary", "findings"}
+
+# Pruning AST sebelum dikirim ke LLM, dapat dimatikan dengan LLM_PRUNE_AST=false
+LLM_PRUNE_AST = os.getenv("LLM_PRUNE_AST", "true").lower() in ("1", "true", "yes")
+# Field dan nodeType AST yang tidak relevan untuk analisis keamanan.
+# Field referensi (referencedDeclaration, scope, dll.) berisi id node solc; karena "id" dibuang,
+# angka tersebut tidak lagi menunjuk ke apa pun sehingga ikut dibuang (pewarisan tetap ada lewat base_contracts).
+PRUNE_KEYS = {
+    "src", "id", "nameLocations", "documentation", "typeIdentifier",
+    "referencedDeclaration", "scope", "linearizedBaseContracts", "baseFunctions", "overrides",
+}
+PRUNE_NODETYPES = {"PragmaDirective", "StructuredDocumentation"}
+
+# Batas token input Gemini dan budget yang dipakai sebagai target aman
+LLM_MAX_INPUT_TOKENS = int(os.getenv("LLM_MAX_INPUT_TOKENS", "1000000"))
+LLM_TOKEN_BUDGET = int(os.getenv("LLM_TOKEN_BUDGET", "800000"))
+# Jumlah prompt KAG hasil serialisasi yang disimpan di memori (key: hash isi knowledge base)
+KAG_PROMPT_CACHE_SIZE = int(os.getenv("KAG_PROMPT_CACHE_SIZE", "16"))
+# Tahapan pemangkasan (kumulatif) jika prompt melebihi budget, dimulai dari bagian yang paling tidak penting.
+# Nilai dicocokkan dengan nodeType, atau dengan contractKind untuk ContractDefinition.
+SHRINK_STAGES = [
+    {"PragmaDirective", "UsingForDirective", "ImportDirective"},
+    {"interface"},
+    {"library"},
+]
+
+def _split_template(template: str, field: str) -> Tuple[str, str]:
+    """
+    Memecah template prompt menjadi bagian sebelum dan sesudah placeholder `field`.
+    Dilakukan sekali saat import sehingga tiap request cukup menggabungkan string.
+    """
+    marker = "\x00"
+    head, tail = template.format(**{field: marker}).split(marker)
+    return head, tail
+
+_KAG_PROMPT_HEAD, _KAG_PROMPT_TAIL = _split_template(KAG_SYSTEM_PROMPT, "knowledge_base_str")
+_RECOMMENDATION_PROMPT_HEAD, _RECOMMENDATION_PROMPT_TAIL = _split_template(RECOMMENDATION_SYSTEM_PROMPT, "static_findings_str")
+
+class PromptTooLargeError(ValueError):
+    """Prompt KAG tetap melebihi batas token Gemini meskipun AST sudah dipangkas."""
+
+# Peringkat severity LLM, dari paling ringan hingga paling kritis
+SEVERITY_RANK = {'Kritis': 4, 'Tinggi': 3, 'Sedang': 2, 'Rendah': 1, 'Informasional': 0}
+
 # --- Pydantic Models untuk Analisis LLM ---
 
 class LLMIssue(BaseModel):
@@ -50,17 +112,15 @@ class LLMAnalysisResult(BaseModel):
                 self.overall_risk_grading = 'Rendah'
             return self
         
-        severity_rank = {'Kritis': 4, 'Tinggi': 3, 'Sedang': 2, 'Rendah': 1, 'Informasional': 0}
-
         # Cari tingkat keparahan tertinggi
         max_rank_in_findings = 0
         highest_severity_in_findings = "Informasional"
         for issue in self.findings:
-            rank = severity_rank.get(issue.severity, 0)
+            rank = SEVERITY_RANK.get(issue.severity, 0)
             if rank > max_rank_in_findings:
                 max_rank_in_findings = rank
                 highest_severity_in_findings = issue.severity
-        overall_grading_rank = severity_rank.get(self.overall_risk_grading, 0)
+        overall_grading_rank = SEVERITY_RANK.get(self.overall_risk_grading, 0)
 
         # Jika grading lebih rendah dari issue tertinggi, perbaiki
         if overall_grading_rank < max_rank_in_findings:
@@ -88,58 +148,655 @@ class LLMRecommendationResult(BaseModel):
     recommendations: List[LLMRecommendation]
     error: Optional[str] = None
 
+# --- Pydantic Models untuk Input KAG ---
+
+class ContractView(BaseModel):
+    """
+    Ringkasan satu ContractDefinition dalam bentuk struct-of-arrays: setiap koleksi
+    (function, state variable) disimpan sebagai list paralel dengan indeks yang sama.
+    """
+    name: str
+    kind: str = "contract"
+    base_contracts: List[str] = Field(default_factory=list)
+    modifier_names: List[str] = Field(default_factory=list)
+    function_names: List[str] = Field(default_factory=list)
+    function_visibilities: List[str] = Field(default_factory=list)
+    function_mutabilities: List[str] = Field(default_factory=list)
+    function_modifiers: List[List[str]] = Field(default_factory=list)
+    state_var_names: List[str] = Field(default_factory=list)
+    state_var_types: List[str] = Field(default_factory=list)
+    state_var_visibilities: List[str] = Field(default_factory=list)
+
+class ASTForLLM(BaseModel):
+    """
+    Input analisis KAG yang divalidasi sekali di endpoint.
+    Dapat dibuat langsung dari input JSON mentah (metadata + AST): ringkasan kontrak
+    diekstrak otomatis, sedangkan AST lengkap disimpan apa adanya di `knowledge_base`.
+    """
+    contract_metadata: Dict[str, Any]
+    # AST hanya diteruskan ke serializer prompt, jadi cukup dicek tipenya tanpa validasi per node
+    knowledge_base: Any
+    contracts: List[ContractView] = Field(default_factory=list)
+
+    @model_validator(mode='before')
+    @classmethod
+    def from_raw_input(cls, data: Any) -> Any:
+        if isinstance(data, dict) and "knowledge_base" not in data:
+            return {
+                "contract_metadata": data.get("contract_metadata"),
+                "knowledge_base": data,
+                "contracts": extract_contract_views(data),
+            }
+        return data
+
+    @field_validator('knowledge_base')
+    def require_object(cls, v: Any) -> Dict[str, Any]:
+        if not isinstance(v, dict):
+            raise ValueError("Knowledge base harus berupa objek JSON.")
+        return v
+
+    @field_validator('contract_metadata')
+    def require_token_address(cls, v: Dict[str, Any]) -> Dict[str, Any]:
+        if not v.get("token_address"):
+            raise ValueError("'contract_metadata' harus berisi 'token_address'.")
+        return v
+
+    @cached_property
+    def content_hash(self) -> str:
+        """Hash sha256 dari isi knowledge base (metadata + AST), dihitung sekali per input."""
+        return hashlib.sha256(canonical_json_bytes(self.knowledge_base)).hexdigest()
+
+# --- Serialisasi Knowledge Base (Format Kolumnar) ---
+
+def _is_ast_node(value: Any) -> bool:
+    """Node AST solc selalu berupa dict yang memiliki key 'nodeType'."""
+    return isinstance(value, dict) and "nodeType" in value
+
+def _is_pruned(value: Any, prune_nodetypes: AbstractSet[str]) -> bool:
+    if not isinstance(value, dict):
+        return False
+    node_type = value.get("nodeType")
+    if node_type == "ContractDefinition":
+        return node_type in prune_nodetypes or value.get("contractKind") in prune_nodetypes
+    return node_type in prune_nodetypes
+
+def _filtered_copy(node: Any, drop_keys: AbstractSet[str], drop_node: Callable[[Any], bool]) -> Any:
+    """
+    Membuat salinan struktur JSON tanpa key di drop_keys dan tanpa nilai yang memenuhi drop_node.
+    Traversal dilakukan secara iteratif dan input asli tidak diubah.
+    """
+    if drop_node(node):
+        return None
+    if not isinstance(node, (dict, list)):
+        return node
+
+    root = {} if isinstance(node, dict) else []
+    stack = [(node, root)]
+    while stack:
+        source, target = stack.pop()
+        items = source.items() if isinstance(source, dict) else enumerate(source)
+        for key, value in items:
+            if isinstance(source, dict) and key in drop_keys:
+                continue
+            if drop_node(value):
+                continue
+            if isinstance(value, (dict, list)):
+                copy = {} if isinstance(value, dict) else []
+                stack.append((value, copy))
+                value = copy
+            if isinstance(target, dict):
+                target[key] = value
+            else:
+                target.append(value)
+    return root
+
+def _find_contracts(data: Any) -> List[Dict[str, Any]]:
+    """Mengumpulkan semua node ContractDefinition sesuai urutan kemunculannya."""
+    contracts = []
+    stack = [data]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, dict):
+            if current.get("nodeType") == "ContractDefinition":
+                contracts.append(current)
+                continue
+            stack.extend(current.values())
+        elif isinstance(current, list):
+            stack.extend(current)
+    contracts.reverse()
+    return contracts
+
+def _node_name(node: Any, key: str) -> str:
+    """Mengambil node[key]["name"] (cth: baseName, modifierName) jika ada."""
+    value = node.get(key) if isinstance(node, dict) else None
+    return value.get("name", "") if isinstance(value, dict) else ""
+
+def extract_contract_views(full_input_json: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Mengekstrak ringkasan setiap ContractDefinition (nama, pewarisan, function,
+    state variable, modifier) sebagai list paralel untuk ContractView.
+    """
+    views = []
+    for contract in _find_contracts(full_input_json):
+        view = {
+            "name": contract.get("name", ""),
+            "kind": contract.get("contractKind", "contract"),
+            "base_contracts": [_node_name(b, "baseName") for b in contract.get("baseContracts") or []],
+            "modifier_names": [],
+            "function_names": [], "function_visibilities": [], "function_mutabilities": [], "function_modifiers": [],
+            "state_var_names": [], "state_var_types": [], "state_var_visibilities": [],
+        }
+        for node in contract.get("nodes") or []:
+            node_type = node.get("nodeType") if isinstance(node, dict) else None
+            if node_type == "FunctionDefinition":
+                # constructor/fallback/receive tidak memiliki nama, gunakan kind-nya
+                view["function_names"].append(node.get("name") or node.get("kind", ""))
+                view["function_visibilities"].append(node.get("visibility", ""))
+                view["function_mutabilities"].append(node.get("stateMutability", ""))
+                view["function_modifiers"].append([_node_name(m, "modifierName") for m in node.get("modifiers") or []])
+            elif node_type == "VariableDeclaration":
+                view["state_var_names"].append(node.get("name", ""))
+                view["state_var_types"].append((node.get("typeDescriptions") or {}).get("typeString", ""))
+                view["state_var_visibilities"].append(node.get("visibility", ""))
+            elif node_type == "ModifierDefinition":
+                view["modifier_names"].append(node.get("name", ""))
+        views.append(view)
+    return views
+
+def partition_ast(payload: ASTForLLM) -> List[ASTForLLM]:
+    """
+    Memecah input menjadi satu bagian per ContractDefinition (selain interface).
+    Setiap bagian tetap berisi metadata, node di luar kontrak (pragma, import, struct global)
+    dan kontrak induknya (linearizedBaseContracts) agar konteks pewarisan tidak hilang.
+    """
+    full_input_json = payload.knowledge_base
+    targets = [c for c in _find_contracts(full_input_json) if c.get("contractKind") != "interface"]
+    if len(targets) <= 1:
+        return [payload]
+
+    parts = []
+    for target in targets:
+        keep_ids = set(target.get("linearizedBaseContracts") or [])
+        def drop_other_contract(value: Any, target=target, keep_ids=keep_ids) -> bool:
+            return (
+                isinstance(value, dict)
+                and value.get("nodeType") == "ContractDefinition"
+                and value is not target
+                and value.get("id") not in keep_ids
+            )
+        parts.append(ASTForLLM.model_validate(_filtered_copy(full_input_json, set(), drop_other_contract)))
+    return parts
+
+def normalize_ast(
+    ast_dict: Any,
+    drop_keys: AbstractSet[str] = frozenset(),
+    drop_node: Optional[Callable[[Any], bool]] = None,
+    verbatim_keys: AbstractSet[str] = frozenset(),
+) -> Tuple[Any, Dict[str, Dict[str, Any]]]:
+    """
+    Normalisasi AST: setiap node disimpan sekali di tabel `nodes` dan semua
+    kemunculannya diganti dengan {"$ref": "n-<angka>"}. Subtree yang identik
+    (serialisasi kanonik sama) hanya disimpan sekali dan berbagi id yang sama.
+
+    Traversal post-order iteratif; key node adalah serialisasi kanonik field langsungnya
+    dengan anak yang sudah berupa $ref, sehingga total biayanya O(N). Bytes tersebut dipakai
+    langsung sebagai key (bukan hash terpotong) agar subtree berbeda tidak mungkin tertukar.
+    Field di drop_keys dan nilai yang memenuhi drop_node dibuang pada traversal yang sama
+    (tanpa membuat salinan AST hasil pruning terlebih dahulu). Key top-level di
+    verbatim_keys disalin apa adanya tanpa dipangkas maupun dinormalisasi.
+    """
+    table: Dict[str, Dict[str, Any]] = {}
+    key_to_ref: Dict[bytes, str] = {}
+    normalized: Dict[int, Any] = {}
+
+    stack = [(ast_dict, False)]
+    while stack:
+        current, expanded = stack.pop()
+        if id(current) in normalized:
+            continue
+        is_dict = isinstance(current, dict)
+        verbatim = verbatim_keys if is_dict and current is ast_dict else ()
+        items = [
+            (k, v) for k, v in (current.items() if is_dict else enumerate(current))
+            if k in verbatim or (k not in drop_keys and not (drop_node is not None and drop_node(v)))
+        ]
+        if not expanded:
+            stack.append((current, True))
+            stack.extend((v, False) for k, v in reversed(items) if k not in verbatim and isinstance(v, (dict, list)))
+            continue
+
+        values = ((k, normalized[id(v)] if k not in verbatim and isinstance(v, (dict, list)) else v) for k, v in items)
+        result = dict(values) if is_dict else [v for _, v in values]
+
+        if _is_ast_node(current):
+            node_key = canonical_json_bytes(result)
+            ref = key_to_ref.get(node_key)
+            if ref is None:
+                ref = f"n-{len(table) + 1}"
+                key_to_ref[node_key] = ref
+                table[ref] = result
+            result = {"$ref": ref}
+        normalized[id(current)] = result
+
+    return normalized.get(id(ast_dict), ast_dict), table
+
+def _strip_refs(value: Any) -> Any:
+    """Mengganti {"$ref": id} di dalam struktur non-node menjadi string id saja."""
+    if isinstance(value, dict):
+        if "$ref" in value:
+            return value["$ref"]
+        return {k: _strip_refs(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_strip_refs(v) for v in value]
+    return value
+
+def _onto_cell(value: Any) -> str:
+    """Mengubah satu nilai field menjadi sel pada baris kolumnar."""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, str):
+        text = value
+    else:
+        text = _strip_refs(value)
+        if not isinstance(text, str):
+            text = compact_json(text)
+    return text.replace("\\", "\\\\").replace("|", "\\|").replace("\n", "\\n")
+
+def ast_to_onto(
+    ast_dict: Dict[str, Any],
+    drop_keys: AbstractSet[str] = frozenset(),
+    drop_node: Optional[Callable[[Any], bool]] = None,
+    verbatim_keys: AbstractSet[str] = frozenset(),
+) -> str:
+    """
+    Mengubah knowledge base (metadata + AST) ke format kolumnar "schema-once".
+    Nama kolom setiap nodeType ditulis sekali sebagai header, lalu setiap node
+    ditulis sebagai satu baris yang dipisah '|'. Node anak tidak di-inline,
+    melainkan dirujuk lewat id pendek (n-1, n-2, ...) pada kolom 'ref'.
+    Parameter pruning diteruskan ke normalize_ast.
+    """
+    root, table = normalize_ast(ast_dict, drop_keys, drop_node, verbatim_keys)
+
+    buckets: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+    for ref, node in table.items():
+        buckets.setdefault(node["nodeType"], []).append((ref, node))
+
+    lines = [f"ROOT: {_onto_cell(root)}"]
+    for node_type, rows in buckets.items():
+        columns: Dict[str, None] = {}
+        for _, node in rows:
+            columns.update(dict.fromkeys(k for k in node if k != "nodeType"))
+        lines.append("")
+        lines.append(f"{node_type}: ref|" + "|".join(columns))
+        for ref, node in rows:
+            cells = [ref] + [_onto_cell(node.get(col)) for col in columns]
+            lines.append("|".join(cells))
+    return "\n".join(lines)
+
+def contracts_to_onto(contracts: List[ContractView]) -> str:
+    """
+    Menulis ringkasan kontrak sebagai tabel indeks kolumnar. Karena ContractView sudah
+    berupa list paralel, setiap baris cukup dibentuk dengan zip tanpa menelusuri AST lagi.
+    """
+    lines = ["ContractIndex: name|kind|bases|modifiers"]
+    for c in contracts:
+        lines.append("|".join(map(_onto_cell, (c.name, c.kind, ",".join(c.base_contracts), ",".join(c.modifier_names)))))
+
+    lines += ["", "FunctionIndex: contract|name|visibility|stateMutability|modifiers"]
+    for c in contracts:
+        for name, visibility, mutability, modifiers in zip(
+            c.function_names, c.function_visibilities, c.function_mutabilities, c.function_modifiers
+        ):
+            lines.append("|".join(map(_onto_cell, (c.name, name, visibility, mutability, ",".join(modifiers)))))
+
+    lines += ["", "StateVarIndex: contract|name|type|visibility"]
+    for c in contracts:
+        for row in zip(c.state_var_names, c.state_var_types, c.state_var_visibilities):
+            lines.append("|".join(map(_onto_cell, (c.name, *row))))
+    return "\n".join(lines)
+
+_kag_prompt_cache: "OrderedDict[Tuple[str, bool, frozenset], str]" = OrderedDict()
+
+def create_kag_prompt(payload: ASTForLLM, drop_nodetypes: AbstractSet[str] = frozenset()) -> str:
+    """
+    Menyusun prompt KAG dari input yang sudah divalidasi (metadata, ringkasan kontrak, AST).
+    drop_nodetypes berisi nodeType/contractKind tambahan yang dibuang untuk memenuhi budget token.
+    Hasilnya disimpan berdasarkan hash isi input, sehingga AST yang sama (cth: token yang dianalisis
+    ulang) tidak perlu di-prune dan diserialisasi lagi.
+    """
+    key = (payload.content_hash, LLM_PRUNE_AST, frozenset(drop_nodetypes))
+    prompt = _kag_prompt_cache.get(key)
+    if prompt is None:
+        prompt = _build_kag_prompt_text(payload, drop_nodetypes)
+        _kag_prompt_cache[key] = prompt
+    _kag_prompt_cache.move_to_end(key)
+    if len(_kag_prompt_cache) > KAG_PROMPT_CACHE_SIZE:
+        _kag_prompt_cache.popitem(last=False)
+    return prompt
+
+def _build_kag_prompt_text(payload: ASTForLLM, drop_nodetypes: AbstractSet[str]) -> str:
+    prune_keys = PRUNE_KEYS if LLM_PRUNE_AST else set()
+    prune_nodetypes = (PRUNE_NODETYPES if LLM_PRUNE_AST else set()) | set(drop_nodetypes)
+    drop_node = (lambda value: _is_pruned(value, prune_nodetypes)) if prune_nodetypes else None
+    # Pruning dilakukan sekaligus saat normalisasi; metadata kontrak dipertahankan apa adanya
+    kb_onto = ast_to_onto(payload.knowledge_base, prune_keys, drop_node, verbatim_keys={"contract_metadata"})
+    contracts = [c for c in payload.contracts if c.kind not in prune_nodetypes]
+    knowledge_base_str = f"{contracts_to_onto(contracts)}\n\n{kb_onto}"
+    return f"{_KAG_PROMPT_HEAD}{knowledge_base_str}{_KAG_PROMPT_TAIL}"
+
+def estimate_tokens(text: str) -> int:
+    """Estimasi kasar jumlah token (sekitar 4 karakter per token)."""
+    return len(text) // 4
+
 # --- Core Functions ---
 
-async def _call_llm_api(prompt: str, timeout: int=180) -> Dict[str, Any]:
+# Satu AsyncClient dipakai bersama agar koneksi TLS/HTTP2 ke Gemini tidak dibuat ulang di setiap analisis
+_CLIENT = httpx.AsyncClient(
+    http2=True,
+    timeout=LLM_TIMEOUT_SECONDS,
+    limits=httpx.Limits(max_keepalive_connections=20),
+)
+
+# Membatasi jumlah request Gemini yang berjalan bersamaan (generateContent, streaming, dan countTokens),
+# diambil di dalam fungsi pemanggil API sehingga semua jalur (termasuk rekomendasi) ikut dibatasi
+_LLM_SEMAPHORE = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+async def close_client() -> None:
+    """Menutup AsyncClient bersama, dipanggil saat aplikasi FastAPI shutdown."""
+    await _CLIENT.aclose()
+
+_GENERATION_CONFIG_JSON = compact_json_bytes({
+    "response_mime_type": "application/json",
+    "temperature": 0.1,
+    "topP": 0.95,
+})
+
+@lru_cache(maxsize=8)
+def _encoded_contents(prompt: str) -> bytes:
     """
-    Untuk memanggil API Gemini
+    Field 'contents' request Gemini dalam bentuk JSON bytes. Prompt KAG bisa berukuran beberapa MB,
+    sehingga hasilnya disimpan agar countTokens, generateContent dan retry tidak menserialisasi ulang.
     """
+    return compact_json_bytes([{"parts": [{"text": prompt}]}])
+
+def _gemini_request(prompt: str, generation_config: bool = True) -> Tuple[Dict[str, str], bytes]:
+    """Menyusun header (berisi API key) dan body JSON (bytes) untuk request ke Gemini."""
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
         logger.error("GEMINI_API_KEY tidak ditemukan di environment variables.")
         raise ValueError("GEMINI_API_KEY tidak ditemukan di env")
-    
-    api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent?key={api_key}"
-    payload = {
-        "contents": [{"parts": [{"text": prompt}]}],
-        "generationConfig": {
-            "response_mime_type": "application/json",
-            "temperature": 0.1,
-            "topP": 0.95,
-        }
-    }
-    loop = asyncio.get_running_loop()
-    response = await loop.run_in_executor(
-        None,
-        lambda: requests.post(api_url, json=payload, timeout=timeout)
-    )
+
+    # API key dikirim lewat header agar tidak ikut tercetak di pesan error httpx
+    headers = {"x-goog-api-key": api_key, "Content-Type": "application/json"}
+    body = b'{"contents":' + _encoded_contents(prompt)
+    if generation_config:
+        body += b',"generationConfig":' + _GENERATION_CONFIG_JSON
+    return headers, body + b"}"
+
+async def _call_llm_api(prompt: str, timeout: int=LLM_TIMEOUT_SECONDS) -> str:
+    """
+    Untuk memanggil API Gemini. Mengembalikan teks JSON mentah dari model agar
+    parsing dan validasi dapat dilakukan sekaligus dengan model_validate_json.
+    """
+    headers, body = _gemini_request(prompt)
+    async with _LLM_SEMAPHORE:
+        response = await _CLIENT.post(f"{GEMINI_MODEL_URL}:generateContent", content=body, headers=headers, timeout=timeout)
     response.raise_for_status()
-    response_json = response.json()
+    response_json = loads_json(response.content)
 
     if not response_json.get('candidates') or not response_json['candidates'][0].get('content'):
         raise KeyError("Struktur respons LLM tidak valid: 'candidates' atau 'content' tidak ada.")
     
-    result_text = response_json['candidates'][0]['content']['parts'][0]['text']
-    return json.loads(result_text)
+    return response_json['candidates'][0]['content']['parts'][0]['text']
+
+async def _stream_llm_api(prompt: str, timeout: int=LLM_TIMEOUT_SECONDS) -> AsyncIterator[str]:
+    """
+    Memanggil endpoint streaming Gemini (Server-Sent Events) dan
+    menghasilkan potongan teks respons segera setelah diterima.
+    """
+    headers, body = _gemini_request(prompt)
+    api_url = f"{GEMINI_MODEL_URL}:streamGenerateContent?alt=sse"
+    # Slot semaphore dipegang selama stream masih terbuka
+    async with _LLM_SEMAPHORE, _CLIENT.stream("POST", api_url, content=body, headers=headers, timeout=timeout) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            chunk = loads_json(line[len("data:"):].strip())
+            candidates = chunk.get("candidates") or [{}]
+            for part in (candidates[0].get("content") or {}).get("parts", []):
+                if part.get("text"):
+                    yield part["text"]
+
+def _finding_fingerprint(issue: LLMIssue) -> Tuple[str, str]:
+    return issue.category.strip().lower(), issue.description.strip()[:120].lower()
+
+def deduplicate_findings(findings: List[LLMIssue]) -> List[LLMIssue]:
+    """
+    Menghapus temuan duplikat berdasarkan fingerprint (category, 120 karakter awal description).
+    Temuan pertama untuk setiap fingerprint yang dipertahankan.
+    """
+    unique_findings: Dict[Tuple[str, str], LLMIssue] = {}
+    for issue in findings:
+        unique_findings.setdefault(_finding_fingerprint(issue), issue)
+    return list(unique_findings.values())
+
+def _merge_findings(findings: List[LLMIssue]) -> List[LLMIssue]:
+    """
+    De-duplikasi temuan dari beberapa sub-analisis. Kontrak induk ikut di setiap sub-analisis,
+    sehingga temuan yang sama bisa kembali dengan severity berbeda: per fingerprint dipertahankan
+    temuan dengan severity tertinggi (lalu confidence tertinggi), pada posisi kemunculan pertamanya.
+    """
+    unique_findings: Dict[Tuple[str, str], LLMIssue] = {}
+    for issue in findings:
+        key = _finding_fingerprint(issue)
+        current = unique_findings.get(key)
+        if current is None or (SEVERITY_RANK.get(issue.severity, 0), issue.confidence) > (
+            SEVERITY_RANK.get(current.severity, 0), current.confidence
+        ):
+            unique_findings[key] = issue
+    return list(unique_findings.values())
+
+async def _count_tokens(prompt: str) -> int:
+    """Menghitung jumlah token prompt secara pasti lewat endpoint countTokens Gemini."""
+    headers, body = _gemini_request(prompt, generation_config=False)
+    async with _LLM_SEMAPHORE:
+        response = await _CLIENT.post(f"{GEMINI_MODEL_URL}:countTokens", content=body, headers=headers)
+    response.raise_for_status()
+    return loads_json(response.content)["totalTokens"]
 
-async def run_analysis(full_input_json: Dict[str, Any]) -> LLMAnalysisResult:
+async def build_kag_prompt(payload: ASTForLLM, prompt: Optional[str] = None) -> str:
+    """
+    Menyusun prompt KAG yang muat di context window Gemini.
+    Estimasi token (len/4) dipakai lebih dulu; endpoint countTokens hanya dipanggil jika
+    estimasi berada di antara LLM_TOKEN_BUDGET dan LLM_MAX_INPUT_TOKENS. Jika prompt
+    terlalu besar, bagian AST dipangkas bertahap sesuai SHRINK_STAGES.
+    `prompt` dapat diisi dengan hasil create_kag_prompt yang sudah ada agar tidak diserialisasi ulang.
+    """
+    drop_nodetypes: set = set()
+    for stage in [set()] + SHRINK_STAGES:
+        drop_nodetypes |= stage
+        if prompt is None or stage:
+            prompt = create_kag_prompt(payload, drop_nodetypes)
+        tokens = estimate_tokens(prompt)
+        if tokens <= LLM_TOKEN_BUDGET:
+            return prompt
+        if tokens <= LLM_MAX_INPUT_TOKENS:
+            try:
+                tokens = await _count_tokens(prompt)
+            except (httpx.HTTPError, KeyError) as e:
+                logger.warning(f"Gagal menghitung token secara pasti, memakai estimasi: {e}")
+            if tokens <= LLM_MAX_INPUT_TOKENS:
+                return prompt
+        logger.warning(f"Prompt KAG (~{tokens} token) melebihi batas, memangkas AST lebih lanjut.")
+    raise PromptTooLargeError(f"Prompt KAG terlalu besar (~{tokens} token) meskipun AST sudah dipangkas.")
+
+def _kag_cache_key(prompt: str) -> Tuple[str, str]:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest(), PROMPT_VERSION
+
+async def _analyze_prompt(prompt: str) -> LLMAnalysisResult:
+    """Menjalankan satu prompt KAG ke Gemini (atau mengambilnya dari cache) dan memvalidasi hasilnya."""
+    cache_key = _kag_cache_key(prompt)
+    cached = await llm_cache.check(cache_key)
+    if cached is not None:
+        logger.info("Hasil analisis LLM (KAG) diambil dari cache.")
+        return LLMAnalysisResult.model_validate_json(cached)
+
+    report_text = await _call_llm_api(prompt)
+    validated_report = LLMAnalysisResult.model_validate_json(report_text)
+    logger.info("Analisis LLM (KAG) berhasil dan output telah divalidasi.")
+    await llm_cache.save(cache_key, validated_report.model_dump_json().encode("utf-8"))
+    return validated_report
+
+async def _analyze_part(part: ASTForLLM) -> LLMAnalysisResult:
+    return await _analyze_prompt(await build_kag_prompt(part))
+
+def _merge_reports(reports: List[LLMAnalysisResult], errors: List[str]) -> LLMAnalysisResult:
+    """Menggabungkan hasil sub-analisis per kontrak menjadi satu laporan."""
+    worst = max(reports, key=lambda r: SEVERITY_RANK.get(r.overall_risk_grading, 0))
+    return LLMAnalysisResult(
+        executive_summary=" ".join(r.executive_summary for r in reports if r.executive_summary),
+        overall_risk_grading=worst.overall_risk_grading,
+        risk_score=max(r.risk_score for r in reports),
+        findings=_merge_findings([issue for r in reports for issue in r.findings]),
+        error=" | ".join(errors) if errors else None,
+    )
+
+async def run_analysis(payload: ASTForLLM) -> LLMAnalysisResult:
     """
     Fungsi utama untuk modul ini. Menjalankan analisis LLM KAG.
+    Untuk kontrak besar (prompt > LLM_PARTITION_TOKENS), analisis dipecah per kontrak,
+    dijalankan paralel (dibatasi LLM_MAX_CONCURRENCY), lalu hasilnya digabung.
     """
     logger.info("Memulai analisis kontekstual LLM (KAG)...")
 
     try:
-        knowledge_base_str = json.dumps(full_input_json, indent=2)
-        prompt = KAG_SYSTEM_PROMPT.format(knowledge_base_str=knowledge_base_str)
-        report_data = await _call_llm_api(prompt)
-        validated_report = LLMAnalysisResult(**report_data)
-        logger.info("Analisis LLM (KAG) berhasil dan output telah divalidasi.")
-        return validated_report
+        prompt = create_kag_prompt(payload)
+        parts = partition_ast(payload) if estimate_tokens(prompt) > LLM_PARTITION_TOKENS else []
+        if len(parts) <= 1:
+            return await _analyze_prompt(await build_kag_prompt(payload, prompt))
+
+        logger.info(f"Prompt KAG besar, analisis dipecah menjadi {len(parts)} sub-analisis per kontrak.")
+        results = await asyncio.gather(*(_analyze_part(part) for part in parts), return_exceptions=True)
+        reports, errors = [], []
+        for result in results:
+            if isinstance(result, BaseException):
+                errors.append(str(result))
+            elif result.error:
+                errors.append(result.error)
+            else:
+                reports.append(result)
+
+        # Jika semua sub-analisis gagal, tangani seperti kegagalan analisis tunggal
+        if not reports:
+            first_exception = next((r for r in results if isinstance(r, BaseException)), None)
+            if first_exception is not None:
+                raise first_exception
+            return results[0]
+        return _merge_reports(reports, errors)
     except KeyError as e:
         error_msg = f"Struktur respons LLM tidak valid: {e}"
         logger.error(error_msg, exc_info=True)
-        return LLMAnalysisResult(executive_summary="", overall_risk_grading="Error", findings=[], error=error_msg)
+        return LLMAnalysisResult(executive_summary="", overall_risk_grading="Error", risk_score=0, findings=[], error=error_msg)
+    except httpx.HTTPError as e:
+        error_msg = f"Gagal menghubungi Gemini API: {e}"
+        logger.error(error_msg, exc_info=True)
+        return LLMAnalysisResult(executive_summary="", overall_risk_grading="Error", risk_score=0, findings=[], error=error_msg)
+    except PromptTooLargeError as e:
+        logger.error(str(e))
+        return LLMAnalysisResult(executive_summary="", overall_risk_grading="Error", risk_score=0, findings=[], error=str(e))
     
+async def stream_analysis(payload: ASTForLLM) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Versi streaming dari run_analysis. Menghasilkan event berupa tuple (nama_event, data):
+    - ("finding", LLMIssue) untuk setiap temuan segera setelah selesai di-parse,
+    - ("report", LLMAnalysisResult) setelah seluruh respons diterima dan divalidasi,
+    - ("error", str) jika analisis gagal.
+    Respons yang bukan objek JSON atau rusak langsung menghasilkan error tanpa menunggu stream selesai.
+    Jika LLM_MAX_FINDINGS > 0, stream dihentikan setelah jumlah temuan tersebut terkumpul
+    (laporan terpotong ini tidak disimpan ke cache).
+    """
+    logger.info("Memulai analisis kontekstual LLM (KAG) secara streaming...")
+
+    try:
+        prompt = await build_kag_prompt(payload)
+        cache_key = _kag_cache_key(prompt)
+        cached = await llm_cache.check(cache_key)
+        if cached is not None:
+            logger.info("Hasil analisis LLM (KAG) diambil dari cache.")
+            report = LLMAnalysisResult.model_validate_json(cached)
+            for issue in report.findings:
+                yield "finding", issue
+            yield "report", report
+            return
+
+        # Parser JSON inkremental: setiap elemen 'findings' langsung tersedia begitu selesai di-parse,
+        # sedangkan field top-level (executive_summary, risk_score, ...) dicatat untuk validasi struktur
+        parsed_findings = ijson.sendable_list()
+        findings_parser = ijson.items_coro(parsed_findings, "findings.item", use_float=True)
+        parsed_fields = ijson.sendable_list()
+        fields_parser = ijson.kvitems_coro(parsed_fields, "", use_float=True)
+        report_fields: Dict[str, Any] = {}
+        findings: List[LLMIssue] = []
+        text_parts = []
+        truncated = False
+
+        async with aclosing(_stream_llm_api(prompt)) as chunks:
+            async for text in chunks:
+                if not text_parts and text.strip() and not text.lstrip().startswith("{"):
+                    raise ValueError("Respons LLM bukan objek JSON.")
+                text_parts.append(text)
+                data = text.encode("utf-8")
+                findings_parser.send(data)
+                fields_parser.send(data)
+                report_fields.update(parsed_fields)
+                del parsed_fields[:]
+
+                for item in parsed_findings:
+                    try:
+                        issue = LLMIssue(**item)
+                    except ValueError as e:
+                        logger.warning(f"Temuan LLM tidak valid dilewati: {e}")
+                        continue
+                    findings.append(issue)
+                    yield "finding", issue
+                del parsed_findings[:]
+
+                # Keluar dari context manager menutup stream httpx sehingga request ke Gemini dibatalkan
+                if LLM_MAX_FINDINGS and len(findings) >= LLM_MAX_FINDINGS:
+                    truncated = True
+                    break
+
+        if truncated:
+            logger.info(f"Batas {LLM_MAX_FINDINGS} temuan tercapai, stream LLM dihentikan lebih awal.")
+            report_fields["findings"] = findings[:LLM_MAX_FINDINGS]
+            yield "report", LLMAnalysisResult.model_validate(report_fields)
+            return
+
+        findings_parser.close()
+        fields_parser.close()
+        report_fields.update(parsed_fields)
+        missing_keys = REQUIRED_REPORT_KEYS - report_fields.keys()
+        if missing_keys:
+            raise ValueError(f"Respons LLM tidak memiliki field wajib: {sorted(missing_keys)}")
+
+        validated_report = LLMAnalysisResult.model_validate_json("".join(text_parts))
+        logger.info("Analisis LLM (KAG) streaming berhasil dan output telah divalidasi.")
+        await llm_cache.save(cache_key, validated_report.model_dump_json().encode("utf-8"))
+        yield "report", validated_report
+    except (KeyError, ValueError, ijson.JSONError) as e:
+        error_msg = f"Struktur respons LLM tidak valid: {e}"
+        logger.error(error_msg, exc_info=True)
+        yield "error", error_msg
+    except httpx.HTTPError as e:
+        error_msg = f"Gagal menghubungi Gemini API: {e}"
+        logger.error(error_msg, exc_info=True)
+        yield "error", error_msg
+
 async def generate_recommendations(static_findings: List[Dict[str, Any]]) -> LLMRecommendationResult:
     """
     Fungsi untuk menghasilkan rekomendasi perbaikan berdasarkan temuan analisis statis.
@@ -150,15 +807,19 @@ async def generate_recommendations(static_findings: List[Dict[str, Any]]) -> LLM
         return LLMRecommendationResult(recommendations=[], error="Tidak ada temuan statis yang diberikan.")
 
     try:
-        static_findings_str = json.dumps(static_findings, indent=2)
-        prompt = RECOMMENDATION_SYSTEM_PROMPT.format(static_findings_str=static_findings_str)
+        static_findings_str = dumps_json(static_findings)
+        prompt = f"{_RECOMMENDATION_PROMPT_HEAD}{static_findings_str}{_RECOMMENDATION_PROMPT_TAIL}"
 
-        recommendation_data = await _call_llm_api(prompt)
+        recommendation_text = await _call_llm_api(prompt)
 
-        validated_report = LLMRecommendationResult(**recommendation_data)
+        validated_report = LLMRecommendationResult.model_validate_json(recommendation_text)
         logger.info("Rekomendasi LLM berhasil dan output telah divalidasi.")
         return validated_report
     except KeyError as e:
         error_msg = f"Struktur respons rekomendasi tidak valid: {e}"
         logger.error(error_msg, exc_info=True)
+        return LLMRecommendationResult(recommendations=[], error=error_msg)
+    except httpx.HTTPError as e:
+        error_msg = f"Gagal menghubungi Gemini API: {e}"
+        logger.error(error_msg, exc_info=True)
         return LLMRecommendationResult(recommendations=[], error=error_msg)
\ No newline at end of file
@@ -0,0 +1,82 @@
+"""
+File: llm_cache.py
+Cache persisten (SQLite) untuk respons LLM. Analisis ulang terhadap prompt yang sama
+(cth: token address yang sama) langsung mengembalikan hasil sebelumnya tanpa memanggil Gemini.
+"""
+
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+from contextlib import closing
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CACHE_DB_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.db")
+DEFAULT_TTL_SECONDS = 7 * 86400
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    input_hash TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    response BLOB NOT NULL,
+    created_at INTEGER NOT NULL,
+    expires_at INTEGER NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_llm_cache_key ON llm_cache (input_hash, prompt_version);
+"""
+
+_schema_ready = False
+
+def _connect() -> sqlite3.Connection:
+    """
+    Membuka koneksi SQLite dan memastikan tabel cache sudah ada.
+    `with conn` hanya commit/rollback, jadi pemanggil menutup koneksi lewat contextlib.closing.
+    """
+    global _schema_ready
+    conn = sqlite3.connect(CACHE_DB_PATH)
+    if not _schema_ready:
+        conn.executescript(_SCHEMA)
+        _schema_ready = True
+    return conn
+
+def _check_sync(key: Tuple[str, str]) -> Optional[bytes]:
+    input_hash, prompt_version = key
+    with closing(_connect()) as conn, conn:
+        row = conn.execute(
+            "SELECT response FROM llm_cache WHERE input_hash = ? AND prompt_version = ? AND expires_at > ?",
+            (input_hash, prompt_version, int(time.time())),
+        ).fetchone()
+    return bytes(row[0]) if row else None
+
+def _save_sync(key: Tuple[str, str], resp: bytes, ttl: int) -> None:
+    input_hash, prompt_version = key
+    now = int(time.time())
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (input_hash, prompt_version, response, created_at, expires_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (input_hash, prompt_version, resp, now, now + ttl),
+        )
+        # Entri kedaluwarsa dibersihkan saat menyimpan agar tabel tidak tumbuh tanpa batas
+        conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+
+async def check(key: Tuple[str, str]) -> Optional[bytes]:
+    """
+    Mencari respons (JSON mentah dalam bentuk bytes) di cache berdasarkan (input_hash, prompt_version).
+    Mengembalikan None jika tidak ada, kedaluwarsa, atau cache tidak dapat diakses.
+    """
+    try:
+        return await asyncio.to_thread(_check_sync, key)
+    except sqlite3.Error as e:
+        logger.warning(f"Gagal membaca cache LLM: {e}")
+        return None
+
+async def save(key: Tuple[str, str], resp: bytes, ttl: int = DEFAULT_TTL_SECONDS) -> None:
+    """Menyimpan respons LLM yang sudah tervalidasi (JSON bytes) ke cache."""
+    try:
+        await asyncio.to_thread(_save_sync, key, resp, ttl)
+    except sqlite3.Error as e:
+        logger.warning(f"Gagal menyimpan cache LLM: {e}")
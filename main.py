@@ -9,14 +9,19 @@ import os
 import json
 import asyncio
 import tempfile
-import requests
+import dataclasses
 import logging
-from fastapi import FastAPI, HTTPException, Body, File, UploadFile, Depends, Form
-from pydantic import BaseModel, Field, model_validator
+import httpx
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Body, File, UploadFile, Depends, Form, Request
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError, model_validator
 from typing import List, Dict, Any, Optional
 
 import static_analyzer
 import llm_analyzer
+import etherscan_cache
+from json_utils import loads_json
 
 # konfigurasi logging
 logging.basicConfig(
@@ -29,11 +34,6 @@ logger = logging.getLogger(__name__)
 from dotenv import load_dotenv
 load_dotenv()
 
-class AnalysisMetadata(BaseModel):
-    """Metadata tentang kontrak yang dianalisis."""
-    file_path: Optional[str] = Field(None, description="Path file dari kontrak yang dianalisis, jika tersedia.")
-    token_address: str = Field(..., description="Alamat token kontrak di blockchain.")
-
 class AnalysisMetadata(BaseModel):
     """
     Metadata smart contract dianalisis menggunakan KAG.
@@ -41,13 +41,47 @@ class AnalysisMetadata(BaseModel):
     token_address: str = Field(..., description="Alamat token kontrak yang dianalisis.")
     fetch_source_code_from_etherscan: str = Field(None, description="Source code kontrak yang diambil dari Etherscan, jika tersedia.")
 
+class HybridAnalysisResult(BaseModel):
+    """
+    Gabungan hasil analisis statis dan analisis LLM (KAG) dari endpoint /analyze.
+    Jika salah satu analisis gagal, field-nya bernilai None dan pesan error dicatat di 'errors'.
+    """
+    static_analysis: Optional[static_analyzer.StaticAnalysisOutput] = None
+    llm_analysis: Optional[llm_analyzer.LLMAnalysisResult] = None
+    errors: List[str] = Field(default_factory=list)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Menutup koneksi HTTP bersama (Etherscan dan llm_analyzer) saat aplikasi berhenti."""
+    yield
+    await _ETHERSCAN_CLIENT.aclose()
+    await llm_analyzer.close_client()
+
 app = FastAPI(
     title="Hybrid Smart Contract Analyzer",
     description="Menjalankan analisis statis (Slither, Mythril) dan analisis LLM (KAG) secara paralel menggunakan Docker.",
-    version="3.1.0"
+    version="3.1.0",
+    lifespan=lifespan
 )
 
-def fetch_source_code_from_etherscan(address: str) -> str:
+# AsyncClient bersama untuk Etherscan agar request tidak memblokir event loop
+_ETHERSCAN_CLIENT = httpx.AsyncClient(timeout=20)
+
+async def fetch_source_code_from_etherscan(address: str) -> str:
+    """
+    Mengambil source code kontrak, dari cache jika alamat sudah pernah diambil.
+    Source code kontrak terverifikasi tidak berubah, sehingga cache tidak perlu kedaluwarsa.
+    """
+    cached_code = await etherscan_cache.check(address)
+    if cached_code is not None:
+        logger.info(f"Source code untuk alamat {address} diambil dari cache.")
+        return cached_code
+
+    source_code = await _request_source_code_from_etherscan(address)
+    await etherscan_cache.save(address, source_code)
+    return source_code
+
+async def _request_source_code_from_etherscan(address: str) -> str:
     """
     Mengambil source code dari Etherscan menggunakan API.
     Membutuhkan ETHERSCAN_API_KEY di environment.
@@ -62,9 +96,9 @@ def fetch_source_code_from_etherscan(address: str) -> str:
     logger.info(f"Mengambil source code untuk alamat: {address}")
     
     try:
-        response = requests.get(api_url, timeout=20)
+        response = await _ETHERSCAN_CLIENT.get(api_url)
         response.raise_for_status()
-        data = response.json()
+        data = loads_json(response.content)
 
         if data['status'] == '1' and data['result'][0]['SourceCode']:
             source_code = data['result'][0]['SourceCode']
@@ -73,12 +107,11 @@ def fetch_source_code_from_etherscan(address: str) -> str:
                 source_code = source_code[1:-1]
                 # Jika source code adalah struktur JSON (untuk multi-file), kita coba parse
                 try:
-                    source_files = json.loads(source_code)
+                    source_files = loads_json(source_code)
                     # Gabungkan semua file menjadi satu string kode
                     # Ini adalah penyederhanaan; idealnya, tool harus mendukung multi-file
-                    combined_code = ""
-                    for file_info in source_files.get('sources', {}).values():
-                        combined_code += file_info.get('content', '') + "\n\n"
+                    parts = [file_info.get('content', '') for file_info in source_files.get('sources', {}).values()]
+                    combined_code = "\n\n".join(parts)
                     logger.info("Source code multi-file berhasil digabungkan.")
                     return combined_code
                 except json.JSONDecodeError:
@@ -92,10 +125,29 @@ def fetch_source_code_from_etherscan(address: str) -> str:
             logger.warning(f"Gagal mengambil source code dari Etherscan: {error_message}")
             raise HTTPException(status_code=404, detail=f"Tidak dapat mengambil source code untuk alamat {address}. Pesan: {error_message}")
 
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, json.JSONDecodeError) as e:
+        # Body non-JSON (cth: halaman HTML rate-limit) diperlakukan sama seperti kegagalan request
         logger.error(f"Error saat request ke Etherscan API: {e}")
         raise HTTPException(status_code=503, detail=f"Error saat menghubungi Etherscan API: {e}")
 
+def _write_temp_source(source_code: str) -> str:
+    """Menyimpan source code ke file .sol sementara dan mengembalikan path-nya."""
+    # Encode sekali ke UTF-8 lalu tulis dalam mode biner, tanpa lapisan text I/O
+    with tempfile.NamedTemporaryFile(mode='wb', suffix=".sol", delete=False) as tmp_file:
+        tmp_file.write(source_code.encode("utf-8"))
+    logger.info(f"Source code disimpan sementara di: {tmp_file.name}")
+    return tmp_file.name
+
+def _remove_temp_source(tmp_file_path: str) -> None:
+    """Menghapus file source code sementara jika masih ada."""
+    if tmp_file_path and os.path.exists(tmp_file_path):
+        os.remove(tmp_file_path)
+        logger.info(f"File sementara {tmp_file_path} telah dihapus.")
+
+def _json_response(model: BaseModel) -> Response:
+    """Serialisasi response model langsung ke JSON tanpa melalui representasi dict."""
+    return Response(model.model_dump_json(), media_type="application/json")
+
 @app.post("/static-analysis", response_model=static_analyzer.StaticAnalysisOutput, summary="Static Analysis")
 async def static_analysis(input_data: Dict[str, Any] = Body(..., description="Input data untuk analisis statis.")):
     """
@@ -115,31 +167,49 @@ async def static_analysis(input_data: Dict[str, Any] = Body(..., description="In
         raise HTTPException(status_code=400, detail="Input JSON harus berisi 'contract_metadata' dengan 'token_address' dan 'solidity_version'.")
 
     sol_version = solidity_version.strip("^")
-    source_code = fetch_source_code_from_etherscan(token_address)
+    source_code = await fetch_source_code_from_etherscan(token_address)
 
-    tmp_file_path = ""
+    tmp_file_path = _write_temp_source(source_code)
 
     try:
-        with tempfile.NamedTemporaryFile(mode='w', suffix=".sol", delete=False, encoding="utf-8") as tmp_file:
-            tmp_file.write(source_code)
-            tmp_file_path = tmp_file.name
-        logger.info(f"Source code disimpan sementara di: {tmp_file_path}")
-
-        static_report = await static_analyzer.run_analysis(tmp_file_path, solidity_version)
+        static_report = await static_analyzer.run_analysis(tmp_file_path, sol_version)
         
         if isinstance(static_report, Exception):
             logger.error(f"Analisis static gagal: {static_report}", exc_info=True)
             raise HTTPException(status_code=500, detail=f"Analisis static gagal: {str(static_report)}")
         logger.info("Analisis statis berhasil.")
-        return static_report
+        # Laporan dibuat oleh static_analyzer sendiri, jadi tidak perlu divalidasi ulang oleh response_model
+        return _json_response(static_report)
 
     finally:
-        if tmp_file_path and os.path.exists(tmp_file_path):
-            os.remove(tmp_file_path)
-            logger.info(f"File sementara {tmp_file_path} telah dihapus.")
+        _remove_temp_source(tmp_file_path)
+
+# Body endpoint KAG dibaca sebagai bytes mentah, sehingga skemanya didokumentasikan manual untuk OpenAPI
+_KAG_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "description": "Input JSON lengkap (metadata + AST) untuk analisis LLM.",
+        "content": {"application/json": {"schema": {"type": "object"}}},
+    }
+}
+
+async def _parse_kag_input(request: Request) -> llm_analyzer.ASTForLLM:
+    """
+    Memvalidasi input KAG sekali di endpoint, langkah selanjutnya memakai model bertipe.
+    Body JSON langsung di-parse dan divalidasi oleh pydantic-core tanpa json.loads terlebih dahulu.
+    """
+    try:
+        return llm_analyzer.ASTForLLM.model_validate_json(await request.body())
+    except ValidationError as e:
+        errors = e.errors(include_url=False)
+        if any(err["type"] == "json_invalid" for err in errors):
+            raise HTTPException(status_code=400, detail="Body request bukan JSON yang valid.")
+        # Teruskan detail validasi agar klien dapat membedakan penyebab kegagalan
+        reasons = "; ".join(f"{'.'.join(map(str, err['loc'])) or 'body'}: {err['msg']}" for err in errors)
+        raise HTTPException(status_code=400, detail=f"Input JSON tidak valid: {reasons}")
 
-@app.post("/llm-analysis", response_model=llm_analyzer.LLMAnalysisResult, summary="LLM Analysis")
-async def llm_analysis(full_input_json: Dict[str, Any] = Body(..., description="Input JSON lengkap untuk analisis LLM.")):
+@app.post("/llm-analysis", response_model=llm_analyzer.LLMAnalysisResult, summary="LLM Analysis", openapi_extra=_KAG_REQUEST_BODY)
+async def llm_analysis(request: Request):
     """
     Endpoint untuk LLM analysis dengan KAG
     1. Ambil prompt
@@ -148,16 +218,77 @@ async def llm_analysis(full_input_json: Dict[str, Any] = Body(..., description="
     """
     logger.info("Memulai analisis LLM dengan KAG...")
 
-    if "contract_metadata" not in full_input_json or "token_address" not in full_input_json["contract_metadata"]:
-        raise HTTPException(status_code=400, detail="Input JSON harus berisi 'contract_metadata' dengan 'token_address'.")
-    
-    llm_report = await llm_analyzer.run_analysis(full_input_json)
+    payload = await _parse_kag_input(request)
+    llm_report = await llm_analyzer.run_analysis(payload)
 
     if isinstance(llm_report, Exception):
         logger.error(f"Analisis LLM gagal: {llm_report}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Analisis LLM gagal: {str(llm_report)}")
     logger.info("Analisis LLM berhasil.")
-    return llm_report
+    return _json_response(llm_report)
+
+@app.post("/llm-analysis-stream", summary="LLM Analysis (Streaming)", openapi_extra=_KAG_REQUEST_BODY)
+async def llm_analysis_stream(request: Request):
+    """
+    Endpoint LLM analysis dengan KAG yang mengirim hasil secara bertahap (Server-Sent Events).
+    - event 'finding': satu temuan, dikirim segera setelah di-parse dari respons Gemini
+    - event 'report': laporan lengkap yang sudah divalidasi
+    - event 'error': pesan error jika analisis gagal
+    """
+    payload = await _parse_kag_input(request)
+
+    async def event_stream():
+        async for event, data in llm_analyzer.stream_analysis(payload):
+            body = json.dumps({"error": data}) if event == "error" else data.model_dump_json()
+            yield f"event: {event}\ndata: {body}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.post("/analyze", response_model=HybridAnalysisResult, summary="Hybrid Analysis", openapi_extra=_KAG_REQUEST_BODY)
+async def analyze(request: Request):
+    """
+    Endpoint untuk menjalankan analisis statis dan analisis LLM (KAG) secara paralel.
+    1. Ambil source code dari Etherscan (sekali)
+    2. Jalankan Slither & Mythril dan analisis LLM secara bersamaan
+    3. Gabungkan hasil tanpa duplikat
+    """
+    payload = await _parse_kag_input(request)
+    token_address = payload.contract_metadata["token_address"]
+    solidity_version = payload.contract_metadata.get("solidity_version", "0.8.0")
+
+    if not solidity_version:
+        raise HTTPException(status_code=400, detail="Input JSON harus berisi 'contract_metadata' dengan 'token_address' dan 'solidity_version'.")
+
+    sol_version = solidity_version.strip("^")
+    source_code = await fetch_source_code_from_etherscan(token_address)
+    tmp_file_path = _write_temp_source(source_code)
+
+    try:
+        static_report, llm_report = await asyncio.gather(
+            static_analyzer.run_analysis(tmp_file_path, sol_version),
+            llm_analyzer.run_analysis(payload),
+            return_exceptions=True,
+        )
+    finally:
+        _remove_temp_source(tmp_file_path)
+
+    # Kegagalan salah satu analisis tidak membatalkan hasil analisis lainnya
+    result = HybridAnalysisResult()
+    if isinstance(static_report, Exception):
+        logger.error(f"Analisis static gagal: {static_report}", exc_info=static_report)
+        result.errors.append(f"Analisis static gagal: {str(static_report)}")
+    else:
+        result.static_analysis = static_report
+
+    if isinstance(llm_report, Exception):
+        logger.error(f"Analisis LLM gagal: {llm_report}", exc_info=llm_report)
+        result.errors.append(f"Analisis LLM gagal: {str(llm_report)}")
+    else:
+        findings = llm_analyzer.deduplicate_findings(llm_report.findings)
+        result.llm_analysis = llm_report.model_copy(update={"findings": findings})
+
+    logger.info("Analisis hybrid selesai.")
+    return _json_response(result)
 
 @app.post("/generate-recommendations", response_model=llm_analyzer.LLMRecommendationResult, summary="Generate Recommendations")
 async def generate_recommendations_endpoint(static_analysis_output: static_analyzer.StaticAnalysisOutput = Body(..., description="Output dari analisis statis yang berisi temuan keamanan.")):
@@ -167,7 +298,7 @@ async def generate_recommendations_endpoint(static_analysis_output: static_analy
     2. LLM memberikan penjelasan dan rekomendasi perbaikan
     3. Memberikan rekomendasi
     """
-    findings_dict = [issue.model_dump() for issue in static_analysis_output.issues]
+    findings_dict = [dataclasses.asdict(issue) for issue in static_analysis_output.issues]
     recommendation_result = await llm_analyzer.generate_recommendations(findings_dict)
 
     if isinstance(recommendation_result, Exception):
@@ -1,11 +1,18 @@
 import asyncio
-import json
+import hashlib
+import io
 import os
 import logging
-from pydantic import BaseModel, Field
-from typing import List, Optional, Tuple
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+import ijson
+from pydantic import BaseModel
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 from enum import Enum
 
+from json_utils import loads_json
+
 """
 Konfigurasi logging untuk mengambil nama argumen dan mengembalikan instance logger
 """
@@ -22,59 +29,92 @@ class Severity(str, Enum):
     OPTIMIZATION = "Optimization"
     UNKNOWN = "Unknown"
 
-class StaticIssue(BaseModel):
+@dataclass(slots=True, frozen=True)
+class StaticIssue:
     """
     Mendefinisikan struktur untuk issues yang di temukan dari analisis statis.
+    Dibuat langsung dari output Slither/Mythril yang sudah terstruktur sehingga tidak perlu validasi Pydantic;
+    StaticAnalysisOutput tetap memvalidasi dan menserialisasinya di batas API.
     Check: reentrancy-no-eth, unitialized-state, etc.
+    Severity: tingkat keparahan isu.
     Line: baris kode tempat isu ditemukan.
     Message: deskripsi.
     """
-    check: str = Field(..., description="Jenis kerentanan yang terdeteksi.")
-    severity: Severity = Field(..., description="Tingkat keparahan isu.")
-    line: int = Field(..., description="Nomor baris kode tempat isu ditemukan.")
-    message: str = Field(..., description="Deskripsi singkat tentang isu.")
+    check: str
+    severity: Severity
+    line: int
+    message: str
 
 class StaticAnalysisOutput(BaseModel):
     """
     Kontainer untuk output dari analisis statis
     issues: jika tidak ada isu, akan kosong.
+    Di dalam modul ini dibuat dengan model_construct (tanpa validasi ulang) karena semua field
+    berasal dari parser sendiri; data dari luar (cth: body request) tetap harus lewat validasi.
     """
     tool_name: str
     issues: List[StaticIssue]
     error: Optional[str] = None
 
-def _map_slither_impact_to_severity(impact: str) -> Severity:
-    """Helper untuk memetakan string impact dari Slither ke Enum Severity."""
-    try:
-        # Mencoba mencocokkan langsung (misal: "High" -> Severity.HIGH)
-        return Severity(impact.capitalize())
-    except ValueError:
-        # Jika gagal, berarti nilai tidak ada di Enum, kembalikan UNKNOWN
-        logger.warning(f"Nilai impact Slither tidak dikenal: '{impact}'. Ditetapkan sebagai UNKNOWN.")
+# Lookup severity (huruf kecil) -> Enum, cth: "high" -> Severity.HIGH
+_SEV_MAP = {severity.value.lower(): severity for severity in Severity}
+
+def _map_impact_to_severity(impact: str) -> Severity:
+    """Helper untuk memetakan string impact Slither / severity Mythril ke Enum Severity."""
+    severity = _SEV_MAP.get(impact.lower())
+    if severity is None:
+        # Nilai tidak ada di Enum, kembalikan UNKNOWN
+        logger.warning(f"Nilai severity tidak dikenal: '{impact}'. Ditetapkan sebagai UNKNOWN.")
         return Severity.UNKNOWN
+    return severity
+
+def _slither_line(detector: dict) -> int:
+    """Baris pertama dari elemen pertama detector Slither, atau -1 jika tidak tersedia."""
+    try:
+        return detector["elements"][0]["source_mapping"]["lines"][0] or -1
+    except (KeyError, IndexError, TypeError):
+        return -1
+
+def _slither_extract(detector: dict) -> Tuple[str, Severity, int, str]:
+    """
+    Field StaticIssue dari satu detector Slither, berurutan sesuai dataclass (check, severity, line, message).
+    StaticIssue tidak divalidasi, jadi nilai null dari tool diganti default di sini.
+    """
+    return (
+        detector.get("check") or "N/A",
+        _map_impact_to_severity(detector.get("impact") or "Unknown"),
+        _slither_line(detector),
+        (detector.get("description") or "No description available.").strip(),
+    )
 
 def format_slither_output(slither_raw_json: dict) -> List[StaticIssue]:
     """Mengubah output JSON dari Slither ke format StaticIssue."""
-    formatted_issues = []
     if not slither_raw_json.get("success", False) or not slither_raw_json.get("results", {}).get('detectors'):
         return []
-    
-    for detector in slither_raw_json["results"]["detectors"]:
-        line_number = -1
-        if "elements" in detector and detector["elements"]:
-            lines = detector["elements"][0].get("source_mapping", {}).get("lines", [])
-            if lines:
-                line_number = lines[0]
-
-        impact_str = detector.get("impact", "Unknown")
-        issue = StaticIssue(
-            check=detector.get("check", "N/A"),
-            severity=_map_slither_impact_to_severity(impact_str),
-            line=line_number,
-            message=detector.get("description", "No description available.").strip()
-        )
-        formatted_issues.append(issue)
-    return formatted_issues
+    return [StaticIssue(*_slither_extract(detector)) for detector in slither_raw_json["results"]["detectors"]]
+
+def _parse_slither_output(stdout: bytes) -> dict:
+    """
+    Parse stdout Slither. Output di atas SLITHER_STREAM_THRESHOLD di-parse secara streaming dengan ijson:
+    hanya field 'success' dan 'error' yang dibaca dari top-level, lalu setiap detector langsung diubah
+    menjadi StaticIssue (disimpan di key 'issues') sehingga pohon JSON lengkap tidak pernah dibuat di memori.
+    """
+    if len(stdout) <= SLITHER_STREAM_THRESHOLD:
+        return loads_json(stdout)
+
+    output_json = {}
+    for prefix, _, value in ijson.parse(io.BytesIO(stdout)):
+        if prefix in ("success", "error"):
+            output_json[prefix] = value
+            if len(output_json) == 2:
+                break
+    if output_json.get("success"):
+        detectors = ijson.items(io.BytesIO(stdout), "results.detectors.item", use_float=True)
+        output_json["issues"] = [StaticIssue(*_slither_extract(detector)) for detector in detectors]
+    return output_json
+
+# Tabel translasi untuk mengubah judul isu Mythril menjadi id check (spasi -> '-')
+_SWC_TRANS = str.maketrans({" ": "-"})
 
 def format_mythril_output(mythril_raw_json: dict) -> List[StaticIssue]:
     """Mengubah output JSON dari Mythril ke format StaticIssue."""
@@ -82,46 +122,142 @@ def format_mythril_output(mythril_raw_json: dict) -> List[StaticIssue]:
     if not mythril_raw_json.get("success", False) or not mythril_raw_json.get("issues"):
         return []
 
+    # StaticIssue tidak divalidasi, jadi nilai null dari Mythril (cth: "lineno": null) diganti default di sini
     for issue in mythril_raw_json["issues"]:
-        check_id = issue.get("swc-id", "N/A")
-        title = issue.get("title", "Mythril Issue").replace(" ", "-").lower()
-        check = f"mythril-{check_id}" if check_id != "N/A" else title
+        check_id = issue.get("swc-id")
+        if check_id:
+            check = f"mythril-{check_id}"
+        else:
+            # Judul hanya dinormalisasi jika isu tidak memiliki SWC id
+            check = (issue.get("title") or "Mythril Issue").translate(_SWC_TRANS).lower()
 
-        new_issue = StaticIssue(
+        formatted_issues.append(StaticIssue(
             check=check,
-            severity=issue.get("severity", "Unknown").capitalize(),
-            line=issue.get("lineno", -1),
-            message=issue.get("description", "No description available.").strip()
-        )
-        if new_issue not in formatted_issues:
-            formatted_issues.append(new_issue)
-    return formatted_issues
+            severity=_map_impact_to_severity(issue.get("severity") or "Unknown"),
+            line=issue.get("lineno") or -1,
+            message=(issue.get("description") or "No description available.").strip()
+        ))
+    # StaticIssue bersifat frozen (hashable) sehingga duplikat dibuang dalam O(n) dengan urutan tetap
+    return list(dict.fromkeys(formatted_issues))
+
+def _decode_output(data: bytes) -> str:
+    """Decode output tool (stdout/stderr) menjadi str untuk pesan error."""
+    return data.decode('utf-8', errors='ignore').strip()
 
 # --- Core Functions untuk Menjalankan Tools ---
 
-async def run_tool(command: List[str]) -> Tuple[Optional[dict], Optional[str]]:
-    """Helper untuk menjalankan command line tool secara asynchronous."""
-    process = await asyncio.create_subprocess_exec(
-        *command,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
-    stdout, stderr = await process.communicate()
-    
-    stdout_str = stdout.decode('utf-8', errors='ignore').strip()
-    stderr_str = stderr.decode('utf-8', errors='ignore').strip()
+# Output Slither di atas ukuran ini (bytes) di-parse secara streaming untuk menekan pemakaian memori
+SLITHER_STREAM_THRESHOLD = int(os.getenv("SLITHER_STREAM_THRESHOLD", str(8 * 1024 * 1024)))
+
+# Membatasi jumlah proses Slither/Mythril yang berjalan bersamaan agar request yang datang
+# berbarengan tidak membebani CPU melebihi jumlah core
+STATIC_MAX_CONCURRENCY = int(os.getenv("STATIC_MAX_CONCURRENCY", str(os.cpu_count() or 2)))
+_TOOL_SEMAPHORE = asyncio.Semaphore(STATIC_MAX_CONCURRENCY)
 
-    if process.returncode != 0 and not stdout_str:
-        return None, f"Process exited with code {process.returncode}. STDERR: {stderr_str}"
+async def run_tool(command: List[str], parse: Callable[[bytes], Any] = loads_json) -> Tuple[Optional[dict], Optional[str]]:
+    """Helper untuk menjalankan command line tool secara asynchronous. `parse` mengubah stdout (bytes) menjadi dict."""
+    async with _TOOL_SEMAPHORE:
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            stdout, stderr = await process.communicate()
+        finally:
+            # Jika analisis dibatalkan (cth: tool lain gagal atau client terputus), hentikan prosesnya
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
 
+    # communicate() sudah membaca stdout dan stderr sekaligus dalam satu pass. Buffer stdout tidak
+    # di-strip/di-copy (parser JSON mengabaikan whitespace) dan stderr hanya di-decode untuk pesan error.
+    if process.returncode != 0 and (not stdout or stdout.isspace()):
+        return None, f"Process exited with code {process.returncode}. STDERR: {_decode_output(stderr)}"
+
+    # Output JSON di-parse langsung dari bytes, tanpa decode ke str terlebih dahulu
     try:
-        return json.loads(stdout_str), None
-    except json.JSONDecodeError:
-        return None, f"Failed to parse JSON output. STDOUT: {stdout_str[:500]}... STDERR: {stderr_str}"
+        return parse(stdout), None
+    except (ValueError, ijson.JSONError):
+        stdout_preview = _decode_output(stdout[:500])
+        return None, f"Failed to parse JSON output. STDOUT: {stdout_preview}... STDERR: {_decode_output(stderr)}"
+
+
+# --- Cache Hasil Analisis Statis ---
+
+# Jumlah hasil analisis (per tool) yang disimpan di memori
+STATIC_CACHE_SIZE = int(os.getenv("STATIC_CACHE_SIZE", "128"))
+
+# LRU berisi StaticAnalysisOutput apa adanya, sehingga isi cache selalu sama dengan hasil run pertama
+_result_cache: "OrderedDict[str, StaticAnalysisOutput]" = OrderedDict()
+_result_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0}
+_tool_versions: Dict[str, str] = {}
+
+async def _tool_version(command: List[str]) -> str:
+    """Mengambil versi tool (sekali per proses) agar upgrade tool tidak memakai hasil cache lama."""
+    key = command[0]
+    if key not in _tool_versions:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+            )
+            stdout, _ = await process.communicate()
+            _tool_versions[key] = stdout.decode("utf-8", errors="ignore").strip() or "unknown"
+        except OSError:
+            _tool_versions[key] = "unknown"
+    return _tool_versions[key]
+
+def _result_cache_key(source: bytes, solc_version: str, tool_version: str, command: List[str], file_path: str) -> str:
+    """sha256 dari source code, versi solc, versi tool dan perintah (tanpa path file sementara)."""
+    digest = hashlib.sha256(source)
+    for part in (solc_version, tool_version, *[arg for arg in command if arg != file_path]):
+        digest.update(b"\x00" + part.encode("utf-8"))
+    return digest.hexdigest()
 
+def _cache_get(key: str) -> Optional[StaticAnalysisOutput]:
+    with _result_cache_lock:
+        cached = _result_cache.get(key)
+        if cached is None:
+            _cache_stats["misses"] += 1
+        else:
+            _result_cache.move_to_end(key)
+            _cache_stats["hits"] += 1
+        logger.info(f"Cache analisis statis {'hit' if cached else 'miss'} (hits={_cache_stats['hits']}, misses={_cache_stats['misses']}).")
+    if cached is None:
+        return None
+    # StaticIssue frozen, cukup list-nya yang disalin agar pemanggil tidak bisa mengubah isi cache
+    return StaticAnalysisOutput.model_construct(tool_name=cached.tool_name, issues=list(cached.issues), error=cached.error)
+
+def _cache_put(key: str, output: StaticAnalysisOutput) -> None:
+    with _result_cache_lock:
+        _result_cache[key] = output.model_copy(update={"issues": list(output.issues)})
+        _result_cache.move_to_end(key)
+        if len(_result_cache) > STATIC_CACHE_SIZE:
+            _result_cache.popitem(last=False)
+
+async def _run_cached(
+    command: List[str], version_command: List[str], file_path: str, solc_version: str,
+    run: Callable[[], Awaitable[StaticAnalysisOutput]],
+) -> StaticAnalysisOutput:
+    """
+    Menjalankan `run` kecuali hasil untuk source code, versi solc, versi tool dan perintah
+    yang sama sudah ada di cache. Hanya hasil tanpa error yang disimpan.
+    """
+    with open(file_path, "rb") as f:
+        source = f.read()
+    key = _result_cache_key(source, solc_version, await _tool_version(version_command), command, file_path)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    output = await run()
+    if not output.error:
+        _cache_put(key, output)
+    return output
 
 async def run_slither(file_path: str, solc_version: str) -> StaticAnalysisOutput:
-    """Menjalankan Slither dan memformat hasilnya."""
+    """Menjalankan Slither (atau mengambil hasilnya dari cache) dan memformat hasilnya."""
     # Gunakan solc-select untuk memastikan versi compiler yang tepat
     solc_args = "--allow-paths ."
     command = [
@@ -130,43 +266,50 @@ async def run_slither(file_path: str, solc_version: str) -> StaticAnalysisOutput
         "--json", "-",
         "--solc-args", solc_args
     ]
+    return await _run_cached(command, ["slither", "--version"], file_path, solc_version, lambda: _execute_slither(command))
+
+async def _execute_slither(command: List[str]) -> StaticAnalysisOutput:
     logger.info(f"Menjalankan Slither dengan perintah: {' '.join(command)}")
     
     # Menggunakan run_tool yang sudah diperbarui
-    output_json, stderr_output = await run_tool(command)
+    output_json, stderr_output = await run_tool(command, parse=_parse_slither_output)
     
     # Jika run_tool mengembalikan error, langsung gunakan itu.
     if not output_json:
         error_msg = f"Slither execution failed. Details: {stderr_output}"
         logger.error(error_msg)
-        return StaticAnalysisOutput(tool_name="Slither", issues=[], error=error_msg)
+        return StaticAnalysisOutput.model_construct(tool_name="Slither", issues=[], error=error_msg)
         
     # Jika Slither berhasil tapi melaporkan error internal
     if not output_json.get("success"):
         internal_error = output_json.get("error", "Unknown Slither error.")
         error_msg = f"Slither reported an internal error: {internal_error}. STDERR: {stderr_output or 'Empty'}"
         logger.error(error_msg)
-        return StaticAnalysisOutput(tool_name="Slither", issues=[], error=error_msg)
+        return StaticAnalysisOutput.model_construct(tool_name="Slither", issues=[], error=error_msg)
 
-    issues = format_slither_output(output_json)
+    # Output besar sudah diubah menjadi StaticIssue saat di-parse secara streaming
+    issues = output_json["issues"] if "issues" in output_json else format_slither_output(output_json)
     logger.info(f"Slither selesai, menemukan {len(issues)} isu.")
-    return StaticAnalysisOutput(tool_name="Slither", issues=issues)
+    return StaticAnalysisOutput.model_construct(tool_name="Slither", issues=issues)
 
 
 async def run_mythril(file_path: str, solc_version: str) -> StaticAnalysisOutput:
-    """Menjalankan Mythril dan memformat hasilnya."""
+    """Menjalankan Mythril (atau mengambil hasilnya dari cache) dan memformat hasilnya."""
     command = ["myth", "analyze", file_path, "--solv", solc_version, "-o", "json"]
+    return await _run_cached(command, ["myth", "version"], file_path, solc_version, lambda: _execute_mythril(command))
+
+async def _execute_mythril(command: List[str]) -> StaticAnalysisOutput:
     logger.info(f"Menjalankan Mythril: {' '.join(command)}")
 
     output_json, error = await run_tool(command)
 
     if error:
         logger.error(f"Mythril gagal: {error}")
-        return StaticAnalysisOutput(tool_name="Mythril", issues=[], error=error)
+        return StaticAnalysisOutput.model_construct(tool_name="Mythril", issues=[], error=error)
 
     issues = format_mythril_output(output_json)
     logger.info(f"Mythril selesai, menemukan {len(issues)} isu.")
-    return StaticAnalysisOutput(tool_name="Mythril", issues=issues)
+    return StaticAnalysisOutput.model_construct(tool_name="Mythril", issues=issues)
 
 
 async def run_analysis(file_path: str, solc_version: str) -> StaticAnalysisOutput:
@@ -175,10 +318,17 @@ async def run_analysis(file_path: str, solc_version: str) -> StaticAnalysisOutpu
     dan menggabungkan hasilnya.
     """
     logger.info(f"Memulai semua analisis statis untuk versi solc: {solc_version}")
-    slither_task = run_slither(file_path, solc_version)
-    mythril_task = run_mythril(file_path, solc_version)
-
-    results = await asyncio.gather(slither_task, mythril_task)
+    tasks = [
+        asyncio.ensure_future(run_slither(file_path, solc_version)),
+        asyncio.ensure_future(run_mythril(file_path, solc_version)),
+    ]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        # Jika salah satu tool gagal atau analisis dibatalkan, hentikan tool lainnya
+        for task in tasks:
+            task.cancel()
+        raise
     
     all_issues = []
     all_errors = []
@@ -198,7 +348,7 @@ async def run_analysis(file_path: str, solc_version: str) -> StaticAnalysisOutpu
     
     logger.info(f"Total isu statis unik yang ditemukan: {len(unique_issues)}")
     
-    return StaticAnalysisOutput(
+    return StaticAnalysisOutput.model_construct(
         tool_name="Static Analysis Suite",
         issues=unique_issues,
         error=" | ".join(all_errors) if all_errors else None